@@ -44,6 +44,7 @@ from logging.handlers import RotatingFileHandler
 import os
 import pwd
 import sys
+import weakref
 
 # EXTERNAL
 try:
@@ -54,23 +55,21 @@ except ImportError:
 ## GLOBALS
 #
 NONBLOCKING = True  # Getch blocking
-NONBLOCKING_TIMEOUT = 5  # 0 # Getch, ms
-SLEEPTIME = .002  # Sleep time after update, sec
+NONBLOCKING_TIMEOUT = 7  # 0 # Getch, ms, also paces the main loop
 MOUSEINTERVAL = 150  # Click time, ms
 
 # Logging
 LOGFOLDER = ["/var/log/", "/var/tmp/", "/usr/tmp/", "/tmp/"]
 LOGFILE = "curses-py.log"
 LOGMAX = 10 * 1024**2
-FMAT = r'%(asctime)s.%(msecs)-3d | ' + \
+FMAT = r'%(asctime)s | ' + \
         r'%(levelname)-8s | ' + \
         r'{0:12s} | ' + \
-        r'%(filename)-15s | ' + \
-        r'%(lineno)-5d | ' + \
-        r'%(funcName)-20s | ' + \
         r'%(message)s'
 FTIME = r'%y-%m-%d %H:%M:%S'
-FORMATTER = logging.Formatter(FMAT.format(pwd.getpwuid(os.getuid())[0]), FTIME)
+FORMATTER = logging.Formatter(FMAT.format(pwd.getpwuid(os.getuid())[0]),  # User
+                              FTIME,
+                              validate=False)  # Skip pattern check at init
 LOG = logging.getLogger("curses-py")
 LOG.setLevel(1)
 
@@ -80,21 +79,29 @@ logging.addLevelName(30, '  !WARN ')
 logging.addLevelName(40, ' !!ERRR ')
 logging.addLevelName(50, '!!!CRIT ')
 for folder in LOGFOLDER:
+    if not os.access(folder, os.W_OK):
+        continue
     filename = os.path.join(folder, LOGFILE)
     try:
         fh = RotatingFileHandler(filename, maxBytes=LOGMAX, backupCount=1)
-    except:
+    except OSError:
         continue
     else:
         fh.setFormatter(FORMATTER)
         LOG.addHandler(fh)
         break
-LOG.info("***** {} started at {} *****".format(__file__, NOW))
+LOG.info("***** %s started at %s *****", __file__, NOW)
 
-# Mouse click events
+# Mouse click events, bitmasks of curses button states, see is_sgl/is_dbl
+SGL_MASK = curses.BUTTON1_CLICKED | curses.BUTTON1_RELEASED
+DBL_MASK = curses.BUTTON1_DOUBLE_CLICKED | curses.BUTTON1_TRIPLE_CLICKED
+# Compatibility, e.g. click in SGL_CLICKS, prefer is_sgl/is_dbl
 SGL_CLICKS = (curses.BUTTON1_CLICKED, curses.BUTTON1_RELEASED)
 DBL_CLICKS = (curses.BUTTON1_DOUBLE_CLICKED, curses.BUTTON1_TRIPLE_CLICKED)
 
+# Key events
+QUIT_KEYS = frozenset((ord('q'), ord('Q')))
+
 # Colors, 16 colors can be active at once including 'default'
 CLRS = {
         'default' : -0x01,
@@ -132,20 +139,55 @@ ATTRS = {'bold'  : curses.A_BOLD,
          'uline' : curses.A_UNDERLINE
         }
 
-# Color pair attributes, e.g. PAIRS[(fg,bg)]
-PAIRS = {}
-
 ## CLASSES
 #
+class PairCache(object):
+    """Color pair attributes, allocated with curses.init_pair on first use."""
+
+    __slots__ = ('_m', '_ctr')
+
+    def __init__(self):
+        self._m = {}
+        self._ctr = 0
+
+    def __getitem__(self, key):
+        v = self._m.get(key)
+        if v is not None:
+            return v
+        fg, bg = key
+        if self._ctr >= curses.COLOR_PAIRS - 1:
+            LOG.error("Out of color pairs for (%s, %s)", fg, bg)
+            v = curses.color_pair(0)
+            self._m[key] = v  # Log once, default pair from then on
+            return v
+        self._ctr += 1
+        curses.init_pair(self._ctr, CLRS[fg], CLRS[bg])
+        v = curses.color_pair(self._ctr)
+        self._m[key] = v
+        return v
+
+    def get(self, fg, bg):
+        return self[fg, bg]
+
+# Color pair attributes, e.g. PAIRS[(fg,bg)] or PAIRS.get(fg, bg)
+PAIRS = PairCache()
+
 class Window(object):
     """Curses subwindows."""
 
+    __slots__ = ('_id', 'title', 'scr', '_parent', '_cached_yx', '_bbox',
+                 'titlebar', 'menubar', 'active', 'y', 'x', 'ysize', 'xsize',
+                 '_fg', '_bg', '_pair_key', '_last_bg', '_z', '_dirty',
+                 '_on_click_warn', '_on_init_warn', '_on_key_warn',
+                 '_on_redraw_warn')
+
     _z_top = 0
     has_titlebar = False
     has_menubar = False
     has_border = False
     has_shadows = False
     backgroundch = ' '
+    animated = False  # Call on_redraw every frame, even if not dirty
 
     def __init__(self, scr=None, y=10, x=10, ysize=10, xsize=20, fg='dgray',
             bg='cream', id=None, title=None, **kwargs):
@@ -155,6 +197,9 @@ class Window(object):
 
         # Subwins
         self.scr = scr
+        self._parent = None  # weakref to Desktop, set by add_win
+        self._cached_yx = None  # scr.getmaxyx(), reset on resize
+        self._bbox = None  # (y0, x0, y1, x1) on desktop, set by add_win
         self.titlebar = None
         self.menubar = None
 
@@ -165,21 +210,26 @@ class Window(object):
         self.y = y
         self.x = x
         if ysize < 1:
-            LOG.warn("{}.ysize minimum is 1".format(type(self).__name__))
+            LOG.warning("%s.ysize minimum is 1", type(self).__name__)
             self.ysize = 1
         else:
             self.ysize = ysize
         if xsize < 1:
-            LOG.warn("{}.xsize minimum is 1".format(type(self).__name__))
+            LOG.warning("%s.xsize minimum is 1", type(self).__name__)
             self.xsize = 1
         else:
             self.xsize = xsize
-        self._fg = fg
-        self._bg = bg
+        self._fg = sys.intern(fg)
+        self._bg = sys.intern(bg)
+        self._pair_key = (self._fg, self._bg)  # PAIRS key
+        self._last_bg = None  # bg at last _on_init
 
         # Z level
         self._z = Window._z_top
 
+        # Needs redraw
+        self._dirty = True
+
         # Latched warnings
         self._on_click_warn = False
         self._on_init_warn = False
@@ -187,38 +237,49 @@ class Window(object):
         self._on_redraw_warn = False
 
     def __repr__(self):
-        return "{}: {}(".format(type(self).__name__, self.__class__.__name__) + ", ".join(["{}={}".format(k, v) for k, v in self.__dict__.items()]) + ")"
+        attrs = [(k, getattr(self, k, None)) for cls in reversed(type(self).__mro__) for k in vars(cls).get('__slots__', ())]
+        attrs += getattr(self, '__dict__', {}).items()
+        return "{}: {}(".format(type(self).__name__, self.__class__.__name__) + ", ".join(["{}={}".format(k, v) for k, v in attrs]) + ")"
 
     def _on_click(self, my, mx, click):
+        self._dirty = True
         self.on_click(my, mx, click) # TODO How to translate into y/x for sunwin coordinates?
 
     def _on_init(self):
-        self.scr.clear()
-        self.scr.bkgd(self.backgroundch, PAIRS[(self._fg, self._bg)])
+        self._dirty = True
+        self.scr.erase()  # Not clear(), which forces a full repaint
+        self.scr.bkgd(self.backgroundch, PAIRS[self._pair_key])
         self.on_init()
-        self.scr.redrawwin()  # Touch whole window, needed if bkgd changes
+        if self._last_bg != self._bg:
+            self.scr.redrawwin()  # Touch whole window, needed if bkgd changes
+            self._last_bg = self._bg
 
     def _on_key(self, getch):
+        self._dirty = True
         self.on_key(getch)
 
     def _on_redraw(self):
         try:
             self.on_redraw()
         except curses.error:
-            LOG.error("{} is writing to bad area".format(type(self).__name__))
+            LOG.error("%s is writing to bad area", type(self).__name__)
         # self.scr.vline(0, 223, '|', ymax) <-- End of mouse support
 
     @property
     def _ymax(self):
         if self.active:
-            return self.scr.getmaxyx()[0]
+            if self._cached_yx is None:
+                self._cached_yx = self.scr.getmaxyx()
+            return self._cached_yx[0]
         else:
             return 0
 
     @property
     def _xmax(self):
         if self.active:
-            return self.scr.getmaxyx()[1]
+            if self._cached_yx is None:
+                self._cached_yx = self.scr.getmaxyx()
+            return self._cached_yx[1]
         else:
             return 0
 
@@ -226,32 +287,70 @@ class Window(object):
         self.y = y
         self.x = x
         self.scr.mvwin(y, x)
+        if self._bbox is not None:
+            y0, x0, y1, x1 = self._bbox
+            self._bbox = (y, x, y + y1 - y0, x + x1 - x0)
+        self._dirty = True
 
     def background(self, color):
-        self._bg = color
+        self._bg = sys.intern(color)
+        self._pair_key = (self._fg, self._bg)
+        self._on_init()
+
+    def invalidate(self):
+        """Mark window as needing a redraw on the next frame."""
+        self._dirty = True
+
+    def hide(self):
+        """Stop drawing and clicking this window, its subwin is kept."""
+        self.active = False
+        parent = self._parent() if self._parent is not None else None
+        if parent is not None and self.scr is not None:
+            parent._on_hide(self)  # Repaint the desktop underneath
+
+    def show(self):
+        """Draw and click this window again after hide()."""
+        self.active = True
+        if self.scr is None:
+            LOG.error("%s.show() before Desktop.add_win", type(self).__name__)
+            return
         self._on_init()
 
     def on_click(self, my, mx, click):
         if not self._on_click_warn:
-            LOG.warn("{}.on_click() method should be overridden by subclass".format(type(self).__name__))
+            LOG.warning("%s.on_click() method should be overridden by subclass", type(self).__name__)
             self._on_click_warn = True
 
     def on_init(self):
         if not self._on_init_warn:
-            LOG.warn("{}.on_init() method should be overridden by subclass".format(type(self).__name__))
+            LOG.warning("%s.on_init() method should be overridden by subclass", type(self).__name__)
             self._on_init_warn = True
 
     def on_key(self, getch):
         if not self._on_key_warn:
-            LOG.warn("{}.on_key() method should be overridden by subclass".format(type(self).__name__))
+            LOG.warning("%s.on_key() method should be overridden by subclass", type(self).__name__)
             self._on_key_warn = True
 
     def on_redraw(self):
         if not self._on_redraw_warn:
-            LOG.warn("{}.on_redraw() method should be overridden by subclass".format(type(self).__name__))
+            LOG.warning("%s.on_redraw() method should be overridden by subclass", type(self).__name__)
             self._on_redraw_warn = True
 
-class Desktop(Window):
+class DesktopMeta(type):
+    """Collect Window subclasses declared in a Desktop subclass body."""
+
+    def __init__(cls, name, bases, dct):
+        super().__init__(name, bases, dct)
+        found = {}
+        for base in reversed(cls.__mro__):
+            for key, val in vars(base).items():
+                if key[0] != '_':
+                    found[key] = val
+        cls._window_classes = [found[key] for key in sorted(found)
+                               if isinstance(found[key], type) and
+                               issubclass(found[key], Window)]
+
+class Desktop(Window, metaclass=DesktopMeta):
     """Main curses screen."""
 
     quit_on_q = True
@@ -273,12 +372,12 @@ class Desktop(Window):
         self._init_curses()
         self._init_io()
         self._on_init()
-        self.scr.refresh()
+        self.scr.noutrefresh()
 
         # Assemble all subwin's (Any Window subclass inside a Desktop subclass)
         self._assemble()
 
-        #LOG.debug("{}".format(self))
+        #LOG.debug("%s", self)
 
         # Main update
         self._mainloop()
@@ -287,15 +386,10 @@ class Desktop(Window):
 
         LOG.info("Desktop del'ed.")
 
-        try:
-            getattr(self, 'scr')
-        except AttributeError:
-            pass
-        else:
-            if self.scr is not None:
-                self.scr.leaveok(0)
-                self.scr.scrollok(1)
-                self.scr.keypad(0)
+        if getattr(self, 'scr', None) is not None:
+            self.scr.leaveok(0)
+            self.scr.scrollok(1)
+            self.scr.keypad(0)
         curses.echo()
         curses.nocbreak()
         curses.endwin()
@@ -306,14 +400,7 @@ class Desktop(Window):
         # assert '256' in terminfo  # Your env TERM must be xterm-256color!
         assert curses.has_colors()
         curses.start_color()
-        curses.use_default_colors()
-        ctr = 1
-        for fg in CLRS:
-            for bg in CLRS:
-                if ctr <= curses.COLOR_PAIRS-1 and fg != bg:
-                    curses.init_pair(ctr, CLRS[fg], CLRS[bg])
-                    PAIRS[(fg,bg)] = curses.color_pair(ctr)
-                    ctr += 1
+        curses.use_default_colors()  # Pairs are init'ed lazily by PAIRS.get
 
         # I/O
         availmask, _ = curses.mousemask(curses.ALL_MOUSE_EVENTS)
@@ -340,97 +427,184 @@ class Desktop(Window):
 
     def _assemble(self):
         self.assemble()
+        curses.doupdate()  # Once for all add_win's
+
+    def _on_init(self):
+        # Subwins share stdscr's cells, so erasing the desktop wipes them too
+        super()._on_init()
+        for each in self._windows:
+            if each.active:
+                self._reinit(each)
+
+    def _reinit(self, window):
+        if self._fits(window):
+            try:
+                window._on_init()
+            except curses.error:
+                LOG.error("%s is writing to bad area", type(window).__name__)
+
+    def _fits(self, window):
+        """True if window's subwin is wholly on screen, e.g. after resize."""
+        ymax, xmax = self.scr.getmaxyx()
+        y, x = window.scr.getbegyx()
+        ysize, xsize = window.scr.getmaxyx()
+        return y + ysize <= ymax and x + xsize <= xmax
+
+    def _on_hide(self, window):
+        # Fill the hidden window's cells with desktop background, then redo
+        #  the windows it uncovered or overlapped
+        window.scr.bkgd(self.backgroundch, PAIRS[self._pair_key])
+        window.scr.erase()
+        window.scr.noutrefresh()  # Desktop's lines aren't touched by erase
+        window._last_bg = None  # Own bkgd is forced back on show()
+        box = window._bbox
+        if self.has_shadows:
+            y0, x0, y1, x1 = box
+            try:
+                self.scr.hline(y1, x0+1, ' ', x1-x0, PAIRS[self._pair_key])
+                self.scr.vline(y0+1, x1, ' ', y1-y0, PAIRS[self._pair_key])
+            except curses.error:
+                pass  # Shadow was off screen
+            box = (y0, x0, y1 + 1, x1 + 1)
+        for each in self._windows:
+            if each.active and self._overlaps(box, each):
+                self._reinit(each)
+        self._dirty = True
+
+    @staticmethod
+    def _overlaps(box, window):
+        y0, x0, y1, x1 = box
+        wy0, wx0, wy1, wx1 = window._bbox
+        return y0 < wy1 and wy0 < y1 and x0 < wx1 and wx0 < x1
 
     def _draw_shadow(self, window):
         self.scr.hline(window.y+window._ymax, window.x+1, ' ', window.xsize, PAIRS['white', 'black'])
         self.scr.vline(window.y+1, window.x+window._xmax, ' ', window.ysize, PAIRS['white', 'black'])
 
     def _on_redraw(self):
-        self.on_redraw()
-        if self.has_border:
-            self.scr.border()
-        self.scr.noutrefresh()
-        for window in self._windows:
+        """Redraw dirty windows, return True if any needs a doupdate."""
+        # Only clean windows are skipped, animated ones decide via invalidate()
+        updated = False
+        if self._dirty or self.animated:
+            self.on_redraw()
+        if self._dirty:
+            if self.has_border:
+                self.scr.border()
+            self.scr.noutrefresh()
+            self._dirty = False
+            updated = True
+        windows = self._windows
+        for i, window in enumerate(windows):
             if window.active:
-                window._on_redraw()
-                if self.has_shadows:
-                    self._draw_shadow(window)
-                if window.has_border:
-                    window.scr.border()
-                window.scr.noutrefresh()
-            else:
-                window.scr = None
-        curses.doupdate()
+                if window._dirty or window.animated:
+                    window._on_redraw()
+                if window._dirty:
+                    box = window._bbox
+                    if self.has_shadows:
+                        self._draw_shadow(window)
+                        self._dirty = True  # Shadow is drawn on desktop
+                        box = (box[0], box[1], box[2] + 1, box[3] + 1)
+                    if window.has_border:
+                        window.scr.border()
+                    window.scr.noutrefresh()
+                    window._dirty = False
+                    updated = True
+
+                    # Subwins share stdscr's cells, redo any window above
+                    #  that this one (or its shadow) may have drawn over
+                    for above in windows[i+1:]:
+                        if above.active and self._overlaps(box, above):
+                            self._reinit(above)
+        return updated
 
     def move(self, scr, y, x):
         scr._move(y, x)
         self.reinit_all()
 
-    def reinit_all(self): # TODO is this needed?
-        self._on_init()
+    def _on_resize(self):
+        self._cached_yx = None
+        self.invalidate()
         for each in self._windows:
-            each._on_init()
+            each._cached_yx = None
+            if each._bbox is not None:  # ncurses may have clipped the subwin
+                y, x = each.scr.getbegyx()
+                ysize, xsize = each.scr.getmaxyx()
+                each._bbox = (y, x, y + ysize, x + xsize)
+            each.invalidate()
+
+    def reinit_all(self): # TODO is this needed?
+        self._on_init()  # Also re-inits all active windows
         curses.doupdate()
 
     def _mainloop(self):
         """Main update loop."""
+        # Locals for names looked up every frame
+        on_redraw = self._on_redraw
+        getch_fn = self.scr.getch
+        getmouse = curses.getmouse
+        setsyx = curses.setsyx
+        doupdate = curses.doupdate
+        KEY_MOUSE = curses.KEY_MOUSE
+        KEY_RESIZE = curses.KEY_RESIZE
+
         loop = True
         while loop:
-            # Redraw
-            self._on_redraw()
-            getch = self.scr.getch()
+            # Redraw, one doupdate per frame and only if something changed
+            if on_redraw():
+                setsyx(-1, -1)  # Cursor position doesn't matter
+                doupdate()
+            getch = getch_fn()
 
             # Input
             if getch != -1:
-                if getch in (curses.KEY_MOUSE,):
-                    _, mx, my, _, click = curses.getmouse()
+                if getch == KEY_MOUSE:
+                    _, mx, my, _, click = getmouse()
                     self._on_click(my, mx, click)
                     for window in self._windows:
-                        if window.scr is not None and window.scr.enclose(my, mx):
-                            window._on_click(my, mx, click)
-                elif chr(getch) in 'qQ' and self.quit_on_q:
+                        if window.active:
+                            y0, x0, y1, x1 = window._bbox
+                            if y0 <= my < y1 and x0 <= mx < x1:
+                                window._on_click(my, mx, click)
+                elif getch == KEY_RESIZE:
+                    self._on_resize()
+                elif getch in QUIT_KEYS and self.quit_on_q:
                     loop = False
                 else:
                     self._on_key(getch)
 
-            # Sleep
-            if SLEEPTIME:
-                curses.napms(int(SLEEPTIME*1000))
-
     def assemble(self):
         if not self._assemble_warn:
-            LOG.warn("{}.assemble() method should be overridden by subclass, searching for subwin's automatically".format(type(self).__name__))
+            LOG.warning("%s.assemble() method should be overridden by subclass, searching for subwin's automatically", type(self).__name__)
             self._assemble_warn = True
 
         # Auto assemble and add_win for each Windows subclass defined inside a
         #  Desktop subclass
-        for each in [every for every in dir(self) if every[0] != '_']:
-            cls = getattr(self, each)
-            try:
-                if issubclass(cls, Window):
-                    self.add_win(cls())
-            except TypeError:
-                pass
+        for cls in type(self)._window_classes:
+            self.add_win(cls())
 
     def add_win(self, window):
-        y = min(window.y, self._ymax)
-        x = min(window.x, self._xmax)
-        ysize = min(window.ysize, self._ymax - window.y)
-        xsize = min(window.xsize, self._xmax - window.x)
+        ymax, xmax = self.scr.getmaxyx()
+        y = min(window.y, ymax)
+        x = min(window.x, xmax)
+        ysize = min(window.ysize, ymax - window.y)
+        xsize = min(window.xsize, xmax - window.x)
 
         if window.active:
-            LOG.exception("asdf {} {} {} {}".format(ysize,xsize,y,x))
+            LOG.debug("add_win geom y=%d x=%d ys=%d xs=%d", y, x, ysize, xsize)
             subwin = self.scr.subwin(ysize, xsize, y, x)
             if window.scr is not None:
-                LOG.error("{}.add_win is overridding window.scr".format(type(window).__name__))
+                LOG.error("%s.add_win is overridding window.scr", type(window).__name__)
             window.scr = subwin
+            window._parent = weakref.ref(self)  # No cycle, __del__ runs on exit
+            window._cached_yx = (ysize, xsize)
+            window._bbox = (y, x, y + ysize, x + xsize)
             window._on_init()
-            window.scr.refresh()
+            window.scr.noutrefresh()
 
             Window._z_top += 1
             window._z = Window._z_top
 
-            LOG.debug("{}".format(window))
+            LOG.debug("%s", window)
             self._windows.append(window)
 
 #TODO From here down is a demo and should be moved!!! ---------vvvvvvvvvv
@@ -441,7 +615,9 @@ class GUI(Desktop):
     columns = 3
 
     class MyWin(Window):
+        __slots__ = ('t', 'col')
         has_border = False
+        animated = True
         def __init__(self, *args, **kwargs):
             super().__init__(*args, **kwargs)
             self.t = 0
@@ -454,6 +630,7 @@ class GUI(Desktop):
         def on_redraw(self):
             self.t += 1
             self.scr.addstr(0, 5, '{}'.format(self.t))
+            self.invalidate()
 
     def assemble(self):
         def gen_screen(ymax, xmax):
@@ -480,6 +657,8 @@ class GUI2(Desktop):
     """Template Desktop subclass."""
 
     t = 0
+    animated = True
+    _last_draw = 0.0  # time.monotonic() of last clock update
     class MyWin(Window):
         def on_click(self, my, mx, click):
             self.background('red')
@@ -492,7 +671,12 @@ class GUI2(Desktop):
         self.add_win(GUI2.MyWin())
 
     def on_redraw(self):
+        now = time.monotonic()
+        if not self._dirty and now - self._last_draw < .1:
+            return
+        self._last_draw = now
         self.scr.addstr(0, 0, str(datetime.today()))
+        self.invalidate()
 
     def on_click(self, my, mx, click):
         if self.t < 4:
@@ -504,6 +688,14 @@ class GUI2(Desktop):
 
 ## FUNCTIONS
 #
+def is_sgl(click):
+    """True if an on_click bstate is a single click."""
+    return bool(click & SGL_MASK)
+
+def is_dbl(click):
+    """True if an on_click bstate is a double (or triple) click."""
+    return bool(click & DBL_MASK)
+
 def run():
     curses.wrapper(GUI)
     # curses.wrapper(GUI2)
@@ -515,11 +707,11 @@ if __name__ == '__main__':
         sys.stdout.flush()
         sys.stderr.flush()
     except curses.error as err:
-        LOG.exception("Curses error caught: {}".format(err))
+        LOG.exception("Curses error caught: %s", err)
         if 'add' in str(err):
             LOG.debug("May have written outside of window?")
         raise
     except Exception as err:
-        LOG.exception("Error caught: {}".format(err))
+        LOG.exception("Error caught: %s", err)
         raise
 